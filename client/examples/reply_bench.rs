@@ -0,0 +1,161 @@
+// Compares the cost of the TabReport, TabReportColumns and TabReportPacked reply
+// shapes, without a running service: each shape is built the way the host does
+// it, appended to a DBus message, then read back and encoded to JSON the way the
+// client does it. The columns shape reads the last access column but, like the
+// other two, leaves it out of the JSON output.
+//
+// cargo run --release -p tabreport_client --example reply_bench [TAB_COUNT...]
+
+use dbus::Message;
+use std::env;
+use std::time::{Duration, Instant, SystemTime};
+use tabreport_common::*;
+
+const RUNS: usize = 5;
+
+fn make_tabs(count: u32) -> Vec<(TabId, SystemTime, TabAttributes)> {
+    let now = SystemTime::now();
+    (1..=count)
+        .map(|i| {
+            let attributes = TabAttributes {
+                title: Some(format!("Tab with index {} - Some Site Title", i)),
+                url: Some(format!(
+                    "https://www.test{}.com/some/path?query={}",
+                    i % 50,
+                    i
+                )),
+                window_id: Some(i % 10 + 1),
+                ..TabAttributes::default()
+            };
+            (i, now - Duration::from_millis(i as u64), attributes)
+        })
+        .collect()
+}
+
+fn new_message() -> Message {
+    Message::new_method_call(
+        "net.diegoveralli.tabreport",
+        "/net/diegoveralli/tabreport",
+        "net.diegoveralli.tabreport",
+        "TabReport",
+    )
+    .unwrap()
+}
+
+fn bench_tuples(entries: &[(TabId, &SystemTime, &TabAttributes)]) -> (Duration, Duration) {
+    let start = Instant::now();
+    let list: Vec<(TabId, &TabAttributes)> = entries.iter().map(|(i, _, a)| (*i, *a)).collect();
+    let msg = new_message().append1(unpack_tabs(&list));
+    let encode = start.elapsed();
+
+    let start = Instant::now();
+    let tab_list: DBusTabInfoList = msg.read1().unwrap();
+    let tabs: Vec<TabInfo> = tab_list.iter().map(tuple_to_tab).collect();
+    let json = serde_json::to_string(&tabs).unwrap();
+    let decode = start.elapsed();
+
+    assert!(!json.is_empty());
+    (encode, decode)
+}
+
+fn bench_columns(entries: &[(TabId, &SystemTime, &TabAttributes)]) -> (Duration, Duration) {
+    let start = Instant::now();
+    let (tab_ids, window_ids, last_access, titles, urls) = pack_columns(entries);
+    let msg = new_message()
+        .append3(tab_ids, window_ids, last_access)
+        .append2(titles, urls);
+    let encode = start.elapsed();
+
+    let start = Instant::now();
+    let (tab_ids, window_ids, _, titles, urls): DBusTabColumns = msg.read5().unwrap();
+    let tabs: Vec<TabInfo> = tab_ids
+        .into_iter()
+        .zip(window_ids)
+        .zip(titles.into_iter().zip(urls))
+        .map(|((tab_id, window_id), (title, url))| TabInfo {
+            tab_id,
+            last_access: None,
+            attributes: TabAttributes {
+                title: empty_to_none(title),
+                url: empty_to_none(url),
+                window_id: if window_id == 0 {
+                    None
+                } else {
+                    Some(window_id)
+                },
+                ..TabAttributes::default()
+            },
+        })
+        .collect();
+    let json = serde_json::to_string(&tabs).unwrap();
+    let decode = start.elapsed();
+
+    assert!(!json.is_empty());
+    (encode, decode)
+}
+
+fn bench_packed(entries: &[(TabId, &SystemTime, &TabAttributes)]) -> (Duration, Duration) {
+    let start = Instant::now();
+    let msg = new_message().append1(pack_tabs(entries));
+    let encode = start.elapsed();
+
+    let start = Instant::now();
+    let packed: Vec<u8> = msg.read1().unwrap();
+    let tabs = PackedTabs::parse(&packed).unwrap();
+    let json = serde_json::to_string(&tabs).unwrap();
+    let decode = start.elapsed();
+
+    assert!(!json.is_empty());
+    (encode, decode)
+}
+
+fn best_of<F>(f: F) -> (Duration, Duration)
+where
+    F: Fn() -> (Duration, Duration),
+{
+    (0..RUNS)
+        .map(|_| f())
+        .reduce(|a, b| (a.0.min(b.0), a.1.min(b.1)))
+        .unwrap()
+}
+
+fn main() -> Result<(), Box<dyn std::error::Error>> {
+    let args: Vec<String> = env::args().collect();
+    let counts: Vec<u32> = if args.len() > 1 {
+        args[1..]
+            .iter()
+            .map(|v| v.parse())
+            .collect::<Result<_, _>>()?
+    } else {
+        vec![1_000, 10_000, 50_000]
+    };
+
+    println!(
+        "{:>8} {:>8} {:>12} {:>12}",
+        "tabs", "shape", "encode (us)", "decode (us)"
+    );
+
+    for count in counts {
+        let tabs = make_tabs(count);
+        let entries: Vec<(TabId, &SystemTime, &TabAttributes)> =
+            tabs.iter().map(|(i, ts, a)| (*i, ts, a)).collect();
+
+        let results = [
+            ("tuples", best_of(|| bench_tuples(&entries))),
+            ("columns", best_of(|| bench_columns(&entries))),
+            ("packed", best_of(|| bench_packed(&entries))),
+        ];
+
+        for (name, (encode, decode)) in results {
+            println!(
+                "{:>8} {:>8} {:>12} {:>12}",
+                count,
+                name,
+                encode.as_micros(),
+                decode.as_micros()
+            );
+        }
+    }
+
+    Ok(())
+}
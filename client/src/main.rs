@@ -1,13 +1,68 @@
+use dbus::arg::{prop_cast, PropMap};
 use dbus::blocking::Connection;
+use serde::Serialize;
 use std::env;
-use std::time::Duration;
+use std::io::{self, Write};
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
 use tabreport_common::*;
 
+/// Time spent in each stage of the invocation, reported on stderr as a JSON
+/// object with `--timings`. `start_epoch_us` is the time `main` was entered,
+/// so callers can work out the process startup time.
+struct Timings {
+    start_epoch_us: u64,
+    start: Instant,
+    last: Instant,
+    stages: Vec<(&'static str, Duration)>,
+}
+
+impl Timings {
+    fn new() -> Self {
+        let start = Instant::now();
+        let start_epoch_us = SystemTime::now()
+            .duration_since(UNIX_EPOCH)
+            .map(|d| d.as_micros() as u64)
+            .unwrap_or(0);
+        Timings {
+            start_epoch_us,
+            start,
+            last: start,
+            stages: Vec::with_capacity(8),
+        }
+    }
+
+    fn mark(&mut self, stage: &'static str) {
+        let now = Instant::now();
+        self.stages.push((stage, now - self.last));
+        self.last = now;
+    }
+
+    fn report(&self, error: Option<&dyn std::error::Error>) {
+        let mut result = serde_json::Map::new();
+        result.insert("start_epoch_us".to_string(), self.start_epoch_us.into());
+        if let Some(error) = error {
+            result.insert("error".to_string(), error.to_string().into());
+        }
+        for (stage, duration) in &self.stages {
+            // Stages can repeat, eg. when falling back to an older DBus method
+            let key = format!("{}_us", stage);
+            let previous = result.get(&key).and_then(|v| v.as_u64()).unwrap_or(0);
+            result.insert(key, (previous + duration.as_micros() as u64).into());
+        }
+        result.insert(
+            "total_us".to_string(),
+            (self.start.elapsed().as_micros() as u64).into(),
+        );
+        eprintln!("{}", serde_json::Value::Object(result));
+    }
+}
+
 fn activate(
     tab_id: u32,
     window_preface: Option<&str>,
+    timings: &mut Timings,
 ) -> Result<String, Box<dyn std::error::Error>> {
-    run_dbus_action(|proxy| {
+    run_dbus_action(timings, |proxy| {
         let args: (u32, &str) = (tab_id, window_preface.unwrap_or_default());
         let (msg,): (String,) =
             proxy.method_call("net.diegoveralli.tabreport", "Activate", args)?;
@@ -16,30 +71,34 @@ fn activate(
     })
 }
 
-fn reset(tab_id: u32) -> Result<String, Box<dyn std::error::Error>> {
-    run_dbus_action(|proxy| {
+fn reset(tab_id: u32, timings: &mut Timings) -> Result<String, Box<dyn std::error::Error>> {
+    run_dbus_action(timings, |proxy| {
         let args: (u32,) = (tab_id,);
         let (msg,): (String,) = proxy.method_call("net.diegoveralli.tabreport", "Reset", args)?;
         Ok(msg)
     })
 }
 
-fn run_dbus_action<F, R>(action: F) -> Result<R, Box<dyn std::error::Error>>
+fn run_dbus_action<F, R>(timings: &mut Timings, action: F) -> Result<R, Box<dyn std::error::Error>>
 where
     F: Fn(&dbus::blocking::Proxy<&Connection>) -> Result<R, Box<dyn std::error::Error>>,
 {
     let conn = Connection::new_session()?;
+    timings.mark("connect");
     let proxy = conn.with_proxy(
         "net.diegoveralli.tabreport",
         "/net/diegoveralli/tabreport",
         Duration::from_millis(2000),
     );
 
-    action(&proxy)
+    let result = action(&proxy);
+    timings.mark("call");
+    result
 }
 
-fn get_list() -> Result<Vec<TabInfo>, Box<dyn std::error::Error>> {
+fn get_list(timings: &mut Timings) -> Result<Vec<TabInfo>, Box<dyn std::error::Error>> {
     let conn = Connection::new_session()?;
+    timings.mark("connect");
 
     let proxy = conn.with_proxy(
         "net.diegoveralli.tabreport",
@@ -51,10 +110,12 @@ fn get_list() -> Result<Vec<TabInfo>, Box<dyn std::error::Error>> {
 
     let result: Result<(DBusTabInfoList,), dbus::Error> =
         proxy.method_call("net.diegoveralli.tabreport", "TabReport", args);
+    timings.mark("call");
 
     match result {
         Ok((tab_list,)) => {
             let result = tab_list.iter().map(tuple_to_tab).collect();
+            timings.mark("unmarshal");
             Ok(result)
         }
         Err(e) => {
@@ -69,35 +130,245 @@ fn get_list() -> Result<Vec<TabInfo>, Box<dyn std::error::Error>> {
     }
 }
 
+enum PackedReply {
+    Tabs(Vec<u8>),
+    ServiceUnknown,
+    /// The running host predates `TabReportPacked`, which can happen until
+    /// Firefox restarts it after an upgrade.
+    UnknownMethod,
+}
+
+fn get_packed_list(timings: &mut Timings) -> Result<PackedReply, Box<dyn std::error::Error>> {
+    let conn = Connection::new_session()?;
+    timings.mark("connect");
+
+    let proxy = conn.with_proxy(
+        "net.diegoveralli.tabreport",
+        "/net/diegoveralli/tabreport",
+        Duration::from_millis(5000),
+    );
+
+    let result: Result<(Vec<u8>,), dbus::Error> =
+        proxy.method_call("net.diegoveralli.tabreport", "TabReportPacked", ());
+    timings.mark("call");
+
+    match result {
+        Ok((packed,)) => Ok(PackedReply::Tabs(packed)),
+        Err(e) => match e.name() {
+            Some("org.freedesktop.DBus.Error.ServiceUnknown") => {
+                // This is probably OK, firefox might not be running
+                eprintln!("WARN: DBus service net.diegoveralli.tabreport not found");
+                Ok(PackedReply::ServiceUnknown)
+            }
+            Some("org.freedesktop.DBus.Error.UnknownMethod") => Ok(PackedReply::UnknownMethod),
+            _ => Err(e.into()),
+        },
+    }
+}
+
+fn get_list_with_fields(
+    fields: &[TabField],
+    timings: &mut Timings,
+) -> Result<Vec<TabInfo>, Box<dyn std::error::Error>> {
+    let conn = Connection::new_session()?;
+    timings.mark("connect");
+
+    let proxy = conn.with_proxy(
+        "net.diegoveralli.tabreport",
+        "/net/diegoveralli/tabreport",
+        Duration::from_millis(5000),
+    );
+
+    let names: Vec<&str> = fields.iter().map(TabField::name).collect();
+
+    let result: Result<(u32, Vec<PropMap>), dbus::Error> =
+        proxy.method_call("net.diegoveralli.tabreport", "TabReportFields", (names,));
+    timings.mark("call");
+
+    match result {
+        Ok((version, tab_list)) => {
+            if version != TAB_REPORT_FIELDS_VERSION {
+                return Err(format!("Unsupported TabReportFields version {}", version).into());
+            }
+            let result = tab_list.iter().map(prop_map_to_tab).collect();
+            timings.mark("unmarshal");
+            Ok(result)
+        }
+        Err(e) => {
+            if let Some("org.freedesktop.DBus.Error.ServiceUnknown") = e.name() {
+                eprintln!("WARN: DBus service net.diegoveralli.tabreport not found");
+                Ok(vec![])
+            } else {
+                Err(e.into())
+            }
+        }
+    }
+}
+
+fn get_closed_list(
+    limit: u32,
+    timings: &mut Timings,
+) -> Result<Vec<ClosedTabInfo>, Box<dyn std::error::Error>> {
+    let conn = Connection::new_session()?;
+    timings.mark("connect");
+
+    let proxy = conn.with_proxy(
+        "net.diegoveralli.tabreport",
+        "/net/diegoveralli/tabreport",
+        Duration::from_millis(5000),
+    );
+
+    let result: Result<(u32, Vec<PropMap>), dbus::Error> =
+        proxy.method_call("net.diegoveralli.tabreport", "RecentlyClosed", (limit,));
+    timings.mark("call");
+
+    match result {
+        Ok((version, tab_list)) => {
+            if version != TAB_REPORT_FIELDS_VERSION {
+                return Err(format!("Unsupported RecentlyClosed version {}", version).into());
+            }
+            let result = tab_list
+                .iter()
+                .map(|v| ClosedTabInfo {
+                    closed_at: prop_cast(v, "closed_at").copied().unwrap_or_default(),
+                    tab_info: prop_map_to_tab(v),
+                })
+                .collect();
+            timings.mark("unmarshal");
+            Ok(result)
+        }
+        Err(e) => {
+            if let Some("org.freedesktop.DBus.Error.ServiceUnknown") = e.name() {
+                eprintln!("WARN: DBus service net.diegoveralli.tabreport not found");
+                Ok(vec![])
+            } else {
+                Err(e.into())
+            }
+        }
+    }
+}
+
+fn prop_map_to_tab(source: &PropMap) -> TabInfo {
+    TabInfo {
+        tab_id: prop_cast(source, "tab_id").copied().unwrap_or_default(),
+        last_access: prop_cast(source, "last_access").copied(),
+        attributes: TabAttributes {
+            title: prop_cast(source, "title").cloned(),
+            url: prop_cast(source, "url").cloned(),
+            window_id: prop_cast(source, "window_id").copied(),
+            pinned: prop_cast(source, "pinned").copied(),
+            audible: prop_cast(source, "audible").copied(),
+            discarded: prop_cast(source, "discarded").copied(),
+            cookie_store_id: prop_cast(source, "cookie_store_id").cloned(),
+        },
+    }
+}
+
+fn print_json<T: Serialize>(
+    value: &T,
+    timings: &mut Timings,
+) -> Result<(), Box<dyn std::error::Error>> {
+    let body = serde_json::to_string(value)?;
+    timings.mark("encode");
+
+    let mut stdout = io::stdout().lock();
+    writeln!(stdout, "{}", body)?;
+    stdout.flush()?;
+    timings.mark("write");
+
+    Ok(())
+}
+
 fn main() -> Result<(), Box<dyn std::error::Error>> {
+    let mut timings = Timings::new();
     let args: Vec<String> = env::args().collect();
     let mut tab_id: Option<u32> = None;
     let mut title_preface: Option<&str> = None;
+    let mut fields: Option<Vec<TabField>> = None;
     let mut getting_window_title = false;
+    let mut getting_fields = false;
     let mut is_reset = false;
+    let mut is_closed = false;
+    let mut closed_limit: u32 = 0;
+    let mut getting_closed_limit = false;
+    let mut use_packed = false;
+    let mut show_timings = false;
 
     for arg in &args[1..] {
+        if getting_closed_limit {
+            // The limit is optional, so anything else is parsed as usual
+            getting_closed_limit = false;
+            if let Ok(limit) = arg.parse() {
+                closed_limit = limit;
+                continue;
+            }
+        }
+
         if getting_window_title {
             title_preface = Some(arg);
             getting_window_title = false;
+        } else if getting_fields {
+            let names: Vec<&str> = arg.split(',').filter(|v| !v.is_empty()).collect();
+            fields = Some(parse_fields(&names)?);
+            getting_fields = false;
         } else if !arg.starts_with("--") {
             tab_id = Some(arg.parse()?);
         } else if arg == "--mark" {
             getting_window_title = true;
         } else if arg == "--reset" {
             is_reset = true;
+        } else if arg == "--timings" {
+            show_timings = true;
+        } else if arg == "--packed" {
+            use_packed = true;
+        } else if arg == "--closed" {
+            is_closed = true;
+            getting_closed_limit = true;
+        } else if arg == "--fields" {
+            getting_fields = true;
         }
     }
-    if let Some(tab_id) = tab_id {
-        if is_reset {
-            reset(tab_id)?;
+
+    // Run the command in a closure so that timings are also reported for
+    // failed invocations
+    let result = (|| -> Result<(), Box<dyn std::error::Error>> {
+        if let Some(tab_id) = tab_id {
+            if is_reset {
+                reset(tab_id, &mut timings)?;
+            } else {
+                activate(tab_id, title_preface, &mut timings)?;
+            }
+        } else if is_closed {
+            let tabs = get_closed_list(closed_limit, &mut timings)?;
+            print_json(&tabs, &mut timings)?;
+        } else if let Some(fields) = fields {
+            let tabs = get_list_with_fields(&fields, &mut timings)?;
+            print_json(&tabs, &mut timings)?;
+        } else if use_packed {
+            match get_packed_list(&mut timings)? {
+                PackedReply::Tabs(packed) => {
+                    // Tabs are decoded lazily, so most of the decoding time shows up under "encode"
+                    let tabs = PackedTabs::parse(&packed)?;
+                    timings.mark("unmarshal");
+                    print_json(&tabs, &mut timings)?;
+                }
+                PackedReply::ServiceUnknown => print_json(&Vec::<TabInfo>::new(), &mut timings)?,
+                PackedReply::UnknownMethod => {
+                    let tabs = get_list(&mut timings)?;
+                    print_json(&tabs, &mut timings)?;
+                }
+            }
         } else {
-            activate(tab_id, title_preface)?;
+            let tabs = get_list(&mut timings)?;
+            print_json(&tabs, &mut timings)?;
         }
-    } else {
-        let tabs = get_list()?;
-        println!("{}", serde_json::to_string(&tabs)?);
+
+        Ok(())
+    })();
+
+    if show_timings {
+        timings.report(result.as_ref().err().map(|e| e.as_ref()));
     }
 
-    Ok(())
+    result
 }
@@ -1,13 +1,27 @@
 use serde::{Deserialize, Serialize};
+use std::fmt;
+use std::str::FromStr;
+use std::time::{Duration, SystemTime, UNIX_EPOCH};
 
 pub type TabId = u32;
 pub type WindowId = u32;
 
+/// Version of the messages exchanged between the extension and the host,
+/// announced by the host with a "hello" message on startup. Hosts that don't
+/// send it predate the "attributes" and "reconcile" actions.
+pub const HOST_PROTOCOL_VERSION: u32 = 1;
+
+/// Version of the `TabReportFields` reply. Bump it whenever the meaning or
+/// type of an existing field changes, new fields don't require it.
+pub const TAB_REPORT_FIELDS_VERSION: u32 = 1;
+
 #[derive(Debug, Serialize, Deserialize)]
 pub struct TabEvent {
     pub action: String,
     pub sequence_number: Option<u64>,
     pub error: Option<String>,
+    /// All open tab ids, sent with "reconcile" events.
+    pub tab_ids: Option<Vec<TabId>>,
 
     #[serde(flatten)]
     pub tab_info: TabInfo,
@@ -16,6 +30,9 @@ pub struct TabEvent {
 #[derive(Debug, Serialize, Deserialize)]
 pub struct TabInfo {
     pub tab_id: TabId,
+    /// Milliseconds since the epoch of the last update / activation seen by the host.
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub last_access: Option<u64>,
     #[serde(flatten)]
     pub attributes: TabAttributes,
 }
@@ -25,11 +42,111 @@ pub struct TabAttributes {
     pub title: Option<String>,
     pub url: Option<String>,
     pub window_id: Option<WindowId>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub pinned: Option<bool>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub audible: Option<bool>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub discarded: Option<bool>,
+    #[serde(skip_serializing_if = "Option::is_none")]
+    pub cookie_store_id: Option<String>,
+}
+
+/// Optional fields that can be requested through `TabReportFields`. The tab id
+/// is always included.
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum TabField {
+    Title,
+    Url,
+    WindowId,
+    LastAccess,
+    Pinned,
+    Audible,
+    Discarded,
+    CookieStoreId,
+}
+
+impl TabField {
+    pub const ALL: [TabField; 8] = [
+        TabField::Title,
+        TabField::Url,
+        TabField::WindowId,
+        TabField::LastAccess,
+        TabField::Pinned,
+        TabField::Audible,
+        TabField::Discarded,
+        TabField::CookieStoreId,
+    ];
+
+    pub fn name(&self) -> &'static str {
+        match self {
+            TabField::Title => "title",
+            TabField::Url => "url",
+            TabField::WindowId => "window_id",
+            TabField::LastAccess => "last_access",
+            TabField::Pinned => "pinned",
+            TabField::Audible => "audible",
+            TabField::Discarded => "discarded",
+            TabField::CookieStoreId => "cookie_store_id",
+        }
+    }
+}
+
+impl FromStr for TabField {
+    type Err = String;
+
+    fn from_str(s: &str) -> Result<Self, Self::Err> {
+        TabField::ALL
+            .iter()
+            .find(|f| f.name() == s)
+            .copied()
+            .ok_or_else(|| format!("Unknown tab field: {}", s))
+    }
+}
+
+impl fmt::Display for TabField {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        f.write_str(self.name())
+    }
+}
+
+pub fn parse_fields<S: AsRef<str>>(names: &[S]) -> Result<Vec<TabField>, String> {
+    names.iter().map(|n| n.as_ref().parse()).collect()
+}
+
+pub fn to_epoch_millis(time: &SystemTime) -> u64 {
+    time.duration_since(UNIX_EPOCH)
+        .map(|d| d.as_millis() as u64)
+        .unwrap_or(0)
+}
+
+pub fn from_epoch_millis(millis: u64) -> SystemTime {
+    UNIX_EPOCH + Duration::from_millis(millis)
 }
 
 pub type DBusTabInfo = (TabId, String, String, WindowId);
 pub type DBusTabInfoList = Vec<DBusTabInfo>;
 
+/// Entry of the `RecentlyClosed` reply: the time the tab was closed
+/// (milliseconds since the epoch) and its last known details.
+#[derive(Debug, Serialize, Deserialize)]
+pub struct ClosedTabInfo {
+    pub closed_at: u64,
+    #[serde(flatten)]
+    pub tab_info: TabInfo,
+}
+
+/// Reply of `TabReportColumns`: tab ids, window ids, last access times
+/// (milliseconds since the epoch), titles and URLs, as parallel arrays.
+/// Missing values use the same empty string / 0 convention as `DBusTabInfo`.
+pub type DBusTabColumns = (
+    Vec<TabId>,
+    Vec<WindowId>,
+    Vec<u64>,
+    Vec<String>,
+    Vec<String>,
+);
+
 impl TabAttributes {
     pub fn merge(&mut self, other: &TabAttributes) {
         if self.title.is_none() {
@@ -41,6 +158,18 @@ impl TabAttributes {
         if self.window_id.is_none() {
             self.window_id = other.window_id;
         }
+        if self.pinned.is_none() {
+            self.pinned = other.pinned;
+        }
+        if self.audible.is_none() {
+            self.audible = other.audible;
+        }
+        if self.discarded.is_none() {
+            self.discarded = other.discarded;
+        }
+        if self.cookie_store_id.is_none() {
+            self.cookie_store_id = other.cookie_store_id.as_ref().map(|v| v.to_string());
+        }
     }
 }
 
@@ -57,6 +186,219 @@ pub fn tab_to_tuple(v: &(TabId, &TabAttributes)) -> DBusTabInfo {
     (v.0, title, url, window_id)
 }
 
+pub fn pack_columns(values: &[(TabId, &SystemTime, &TabAttributes)]) -> DBusTabColumns {
+    let mut tab_ids = Vec::with_capacity(values.len());
+    let mut window_ids = Vec::with_capacity(values.len());
+    let mut last_access = Vec::with_capacity(values.len());
+    let mut titles = Vec::with_capacity(values.len());
+    let mut urls = Vec::with_capacity(values.len());
+
+    for (tab_id, ts, attributes) in values {
+        tab_ids.push(*tab_id);
+        window_ids.push(attributes.window_id.unwrap_or(0));
+        last_access.push(to_epoch_millis(ts));
+        titles.push(attributes.title.as_ref().cloned().unwrap_or_default());
+        urls.push(attributes.url.as_ref().cloned().unwrap_or_default());
+    }
+
+    (tab_ids, window_ids, last_access, titles, urls)
+}
+
+/// Version of the `TabReportPacked` byte array format.
+pub const PACKED_TABS_VERSION: u32 = 1;
+
+const PACKED_HEADER_LEN: usize = 8;
+
+/// Encodes tabs into the `TabReportPacked` format. All integers are little-endian:
+///
+/// ```text
+/// header: version: u32, tab count: u32
+/// tab:    tab_id: u32, window_id: u32, last_access: u64 (ms since the epoch),
+///         title length: u32, title: UTF-8 bytes,
+///         url length: u32, url: UTF-8 bytes
+/// ```
+///
+/// As with `DBusTabInfo`, a missing title or URL is encoded as an empty string
+/// and a missing window id as 0.
+pub fn pack_tabs(values: &[(TabId, &SystemTime, &TabAttributes)]) -> Vec<u8> {
+    let strings_len: usize = values
+        .iter()
+        .map(|(_, _, a)| {
+            a.title.as_ref().map_or(0, |v| v.len()) + a.url.as_ref().map_or(0, |v| v.len())
+        })
+        .sum();
+    let mut result = Vec::with_capacity(PACKED_HEADER_LEN + values.len() * 24 + strings_len);
+
+    result.extend_from_slice(&PACKED_TABS_VERSION.to_le_bytes());
+    result.extend_from_slice(&(values.len() as u32).to_le_bytes());
+
+    for (tab_id, ts, attributes) in values {
+        result.extend_from_slice(&tab_id.to_le_bytes());
+        result.extend_from_slice(&attributes.window_id.unwrap_or(0).to_le_bytes());
+        result.extend_from_slice(&to_epoch_millis(ts).to_le_bytes());
+        for value in [&attributes.title, &attributes.url] {
+            let bytes = value.as_deref().unwrap_or_default().as_bytes();
+            result.extend_from_slice(&(bytes.len() as u32).to_le_bytes());
+            result.extend_from_slice(bytes);
+        }
+    }
+
+    result
+}
+
+#[derive(Debug, PartialEq, Eq)]
+pub enum PackedTabsError {
+    Truncated,
+    UnsupportedVersion(u32),
+    InvalidUtf8,
+}
+
+impl fmt::Display for PackedTabsError {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            PackedTabsError::Truncated => f.write_str("Packed tab data is truncated"),
+            PackedTabsError::UnsupportedVersion(v) => {
+                write!(f, "Unsupported packed tab data version {}", v)
+            }
+            PackedTabsError::InvalidUtf8 => f.write_str("Packed tab data contains invalid UTF-8"),
+        }
+    }
+}
+
+impl std::error::Error for PackedTabsError {}
+
+/// Read-only view over a `TabReportPacked` reply. Tabs are decoded lazily
+/// and borrow their strings from the underlying buffer.
+pub struct PackedTabs<'a> {
+    count: u32,
+    data: &'a [u8],
+}
+
+#[derive(Debug, Serialize, PartialEq, Eq)]
+pub struct PackedTab<'a> {
+    pub tab_id: TabId,
+    pub title: Option<&'a str>,
+    pub url: Option<&'a str>,
+    pub window_id: Option<WindowId>,
+    #[serde(skip)]
+    pub last_access: u64,
+}
+
+impl<'a> PackedTabs<'a> {
+    pub fn parse(data: &'a [u8]) -> Result<Self, PackedTabsError> {
+        let mut reader = PackedReader { data };
+        let version = reader.read_u32()?;
+        if version != PACKED_TABS_VERSION {
+            return Err(PackedTabsError::UnsupportedVersion(version));
+        }
+        let count = reader.read_u32()?;
+        Ok(PackedTabs {
+            count,
+            data: reader.data,
+        })
+    }
+
+    pub fn len(&self) -> usize {
+        self.count as usize
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.count == 0
+    }
+
+    pub fn iter(&self) -> PackedTabsIter<'a> {
+        PackedTabsIter {
+            remaining: self.count,
+            reader: PackedReader { data: self.data },
+        }
+    }
+}
+
+impl Serialize for PackedTabs<'_> {
+    fn serialize<S: serde::Serializer>(&self, serializer: S) -> Result<S::Ok, S::Error> {
+        use serde::ser::{Error, SerializeSeq};
+
+        let mut seq = serializer.serialize_seq(Some(self.len()))?;
+        for tab in self.iter() {
+            seq.serialize_element(&tab.map_err(S::Error::custom)?)?;
+        }
+        seq.end()
+    }
+}
+
+pub struct PackedTabsIter<'a> {
+    remaining: u32,
+    reader: PackedReader<'a>,
+}
+
+impl<'a> Iterator for PackedTabsIter<'a> {
+    type Item = Result<PackedTab<'a>, PackedTabsError>;
+
+    fn next(&mut self) -> Option<Self::Item> {
+        if self.remaining == 0 {
+            return None;
+        }
+        self.remaining -= 1;
+
+        let result = self.reader.read_tab();
+        if result.is_err() {
+            self.remaining = 0;
+        }
+        Some(result)
+    }
+
+    fn size_hint(&self) -> (usize, Option<usize>) {
+        (0, Some(self.remaining as usize))
+    }
+}
+
+struct PackedReader<'a> {
+    data: &'a [u8],
+}
+
+impl<'a> PackedReader<'a> {
+    fn take(&mut self, len: usize) -> Result<&'a [u8], PackedTabsError> {
+        if self.data.len() < len {
+            return Err(PackedTabsError::Truncated);
+        }
+        let (head, tail) = self.data.split_at(len);
+        self.data = tail;
+        Ok(head)
+    }
+
+    fn read_u32(&mut self) -> Result<u32, PackedTabsError> {
+        let bytes = self.take(4)?;
+        Ok(u32::from_le_bytes(bytes.try_into().unwrap()))
+    }
+
+    fn read_u64(&mut self) -> Result<u64, PackedTabsError> {
+        let bytes = self.take(8)?;
+        Ok(u64::from_le_bytes(bytes.try_into().unwrap()))
+    }
+
+    fn read_str(&mut self) -> Result<Option<&'a str>, PackedTabsError> {
+        let len = self.read_u32()? as usize;
+        let bytes = self.take(len)?;
+        let value = std::str::from_utf8(bytes).map_err(|_| PackedTabsError::InvalidUtf8)?;
+        Ok(if value.is_empty() { None } else { Some(value) })
+    }
+
+    fn read_tab(&mut self) -> Result<PackedTab<'a>, PackedTabsError> {
+        let tab_id = self.read_u32()?;
+        let window_id = self.read_u32()?;
+        let last_access = self.read_u64()?;
+        let title = self.read_str()?;
+        let url = self.read_str()?;
+        Ok(PackedTab {
+            tab_id,
+            title,
+            url,
+            window_id: get_option_u32(&window_id),
+            last_access,
+        })
+    }
+}
+
 pub fn tuple_to_tab(source: &DBusTabInfo) -> TabInfo {
     let tab_id = source.0;
     let title = get_option_string(&source.1);
@@ -64,10 +406,12 @@ pub fn tuple_to_tab(source: &DBusTabInfo) -> TabInfo {
     let window_id = get_option_u32(&source.3);
     TabInfo {
         tab_id,
+        last_access: None,
         attributes: TabAttributes {
             title,
             url,
             window_id,
+            ..TabAttributes::default()
         },
     }
 }
@@ -95,3 +439,109 @@ pub fn empty_to_none(value: String) -> Option<String> {
         Some(value)
     }
 }
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_pack_columns_should_use_empty_values_for_missing_attributes() {
+        let ts = UNIX_EPOCH + Duration::from_millis(1_700_000_000_123);
+        let first = TabAttributes {
+            title: Some("Some title".to_string()),
+            url: Some("https://example.org/".to_string()),
+            window_id: Some(7),
+            ..TabAttributes::default()
+        };
+        let second = TabAttributes::default();
+
+        let (tab_ids, window_ids, last_access, titles, urls) =
+            pack_columns(&[(1, &ts, &first), (2, &ts, &second)]);
+
+        assert_eq!(tab_ids, vec![1, 2]);
+        assert_eq!(window_ids, vec![7, 0]);
+        assert_eq!(last_access, vec![1_700_000_000_123, 1_700_000_000_123]);
+        assert_eq!(from_epoch_millis(last_access[0]), ts);
+        assert_eq!(titles, vec!["Some title".to_string(), String::new()]);
+        assert_eq!(
+            urls,
+            vec!["https://example.org/".to_string(), String::new()]
+        );
+        assert_eq!(empty_to_none(titles[1].clone()), None);
+    }
+
+    #[test]
+    fn test_packed_tabs_should_round_trip() {
+        let ts = UNIX_EPOCH + Duration::from_millis(1234);
+        let first = TabAttributes {
+            title: Some("Ünïcode title".to_string()),
+            url: Some("https://example.org/".to_string()),
+            window_id: Some(7),
+            ..TabAttributes::default()
+        };
+        let second = TabAttributes::default();
+
+        let packed = pack_tabs(&[(1, &ts, &first), (2, &ts, &second)]);
+        let tabs = PackedTabs::parse(&packed).unwrap();
+        let result: Vec<PackedTab> = tabs.iter().map(|t| t.unwrap()).collect();
+
+        assert_eq!(tabs.len(), 2);
+        assert_eq!(
+            result,
+            vec![
+                PackedTab {
+                    tab_id: 1,
+                    title: Some("Ünïcode title"),
+                    url: Some("https://example.org/"),
+                    window_id: Some(7),
+                    last_access: 1234,
+                },
+                PackedTab {
+                    tab_id: 2,
+                    title: None,
+                    url: None,
+                    window_id: None,
+                    last_access: 1234,
+                },
+            ]
+        );
+    }
+
+    #[test]
+    fn test_packed_tabs_should_serialize_like_tab_info() {
+        let ts = SystemTime::now();
+        let attributes = TabAttributes {
+            title: Some("Title".to_string()),
+            window_id: Some(3),
+            ..TabAttributes::default()
+        };
+
+        let packed = pack_tabs(&[(5, &ts, &attributes)]);
+        let tabs = PackedTabs::parse(&packed).unwrap();
+        let expected = vec![tuple_to_tab(&tab_to_tuple(&(5, &attributes)))];
+
+        assert_eq!(
+            serde_json::to_string(&tabs).unwrap(),
+            serde_json::to_string(&expected).unwrap()
+        );
+    }
+
+    #[test]
+    fn test_packed_tabs_given_truncated_data_it_should_fail() {
+        let ts = SystemTime::now();
+        let attributes = TabAttributes {
+            url: Some("https://example.org/".to_string()),
+            ..TabAttributes::default()
+        };
+
+        let packed = pack_tabs(&[(5, &ts, &attributes)]);
+        let tabs = PackedTabs::parse(&packed[..packed.len() - 1]).unwrap();
+        let result: Vec<_> = tabs.iter().collect();
+
+        assert_eq!(result, vec![Err(PackedTabsError::Truncated)]);
+        assert_eq!(
+            PackedTabs::parse(&PACKED_TABS_VERSION.to_le_bytes()).err(),
+            Some(PackedTabsError::Truncated)
+        );
+    }
+}
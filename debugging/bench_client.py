@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Measures cold start latency of the tabreport CLI. Runs a tabreport_host
+# instance fed with fake tabs on a private session bus (via dbus-run-session,
+# so a running Firefox instance isn't affected), then spawns the client
+# repeatedly with --timings and prints percentiles for each stage.
+#
+# Build first with `cargo build --release`, then eg.:
+#     ./debugging/bench_client.py --tabs 1000 --runs 200
+
+import argparse
+import collections
+import json
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import time
+
+PRIVATE_BUS_ENV = 'TABREPORT_BENCH_PRIVATE_BUS'
+STAGES = ['spawn', 'connect', 'call', 'unmarshal', 'encode', 'write', 'total', 'wall']
+
+
+def send_event(stream, event):
+    content = json.dumps(event).encode('utf-8')
+    stream.write(struct.pack('@I', len(content)))
+    stream.write(content)
+
+
+def start_host(host_path, tab_count):
+    host = subprocess.Popen([host_path], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    for tab_id in range(1, tab_count + 1):
+        send_event(host.stdin, {
+            'action': 'update',
+            'tab_id': tab_id,
+            'title': 'Tab with index {}'.format(tab_id),
+            'window_id': tab_id % 10 + 1,
+            'url': 'http://www.test{}.com/{}'.format(tab_id % 50, tab_id),
+        })
+    host.stdin.flush()
+    return host
+
+
+def wait_for_tabs(client_path, tab_count, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = subprocess.run([client_path], capture_output=True, encoding='utf-8')
+        if result.returncode == 0 and len(json.loads(result.stdout)) == tab_count:
+            return
+        time.sleep(0.1)
+    raise Exception('Host did not report {} tabs within {}s'.format(tab_count, timeout))
+
+
+def parse_timings(stderr):
+    for line in reversed(stderr.strip().splitlines()):
+        try:
+            timings = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(timings, dict) and 'total_us' in timings:
+            return timings
+    return None
+
+
+def run_client(client_args):
+    spawned_at = time.time_ns() // 1000
+    start = time.perf_counter_ns()
+    result = subprocess.run(client_args + ['--timings'], capture_output=True, encoding='utf-8')
+    wall = (time.perf_counter_ns() - start) // 1000
+
+    timings = parse_timings(result.stderr) or {}
+    if 'start_epoch_us' in timings:
+        timings['spawn_us'] = timings['start_epoch_us'] - spawned_at
+    timings['wall_us'] = wall
+    if result.returncode != 0:
+        timings['failed'] = True
+        timings.setdefault('error', result.stderr.strip() or
+                           'exit code {}'.format(result.returncode))
+    return timings
+
+
+def print_percentiles(results):
+    print('{:>10} {:>8} {:>8} {:>8} {:>8}'.format('stage', 'p50', 'p90', 'p99', 'max'))
+    for stage in STAGES:
+        values = [r[stage + '_us'] for r in results if stage + '_us' in r]
+        if len(values) > 1:
+            print('{:>10} {:>8.0f} {:>8.0f} {:>8.0f} {:>8.0f}'.format(stage, *percentiles(values)))
+
+
+def percentiles(values):
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return cuts[49], cuts[89], cuts[98], max(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tabreport CLI cold starts')
+    parser.add_argument('--host', default='target/release/tabreport_host')
+    parser.add_argument('--client', default='target/release/tabreport_client')
+    parser.add_argument('--tabs', type=int, default=1000)
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--packed', action='store_true',
+                        help='pass --packed to the client, to list tabs through TabReportPacked')
+    args = parser.parse_args()
+
+    if os.environ.get(PRIVATE_BUS_ENV) is None:
+        env = dict(os.environ, **{PRIVATE_BUS_ENV: '1'})
+        os.execvpe('dbus-run-session',
+                   ['dbus-run-session', '--', sys.executable] + sys.argv, env)
+
+    host = start_host(args.host, args.tabs)
+    try:
+        wait_for_tabs(args.client, args.tabs)
+        client_args = [args.client] + (['--packed'] if args.packed else [])
+        results = [run_client(client_args) for _ in range(args.runs)]
+    finally:
+        host.stdin.close()
+        host.wait()
+
+    succeeded = [r for r in results if not r.get('failed')]
+    failed = [r for r in results if r.get('failed')]
+
+    print('{} runs, {} tabs, times in microseconds'.format(args.runs, args.tabs))
+    print_percentiles(succeeded)
+
+    if failed:
+        print()
+        print('{} failed runs'.format(len(failed)))
+        print_percentiles(failed)
+        errors = collections.Counter(r['error'] for r in failed)
+        for error, count in errors.most_common():
+            print('{:>6} {}'.format(count, error))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,20 @@
+const FLAG_ATTRIBUTES = ['pinned', 'audible', 'discarded'];
+const RECONCILE_INTERVAL_MS = 5 * 60 * 1000;
+
 function initialise() {
   var port = browser.runtime.connectNative("net.diegoveralli.tabreport");
 
+  // Announced by the host on startup. Hosts older than protocol version 1 don't
+  // send it, and treat unknown actions as updates, so the "attributes" and
+  // "reconcile" actions are only sent once we know the host supports them.
+  let hostProtocolVersion = 0;
+
   port.onMessage.addListener(async (request) => {
+    if (request['action'] == 'hello') {
+      hostProtocolVersion = request['protocol_version'];
+      return;
+    }
+
     let error = null;
 
     let preface = request['window_title_preface'];
@@ -70,11 +83,36 @@ function initialise() {
       if (change.windowId) {
         msg['window_id'] = change.windowId;
       }
+      // Boolean flags can be false, so check for the key instead of the value
+      if ('pinned' in change) {
+        msg['pinned'] = change.pinned;
+      }
+      if ('audible' in change) {
+        msg['audible'] = change.audible;
+      }
+      if ('discarded' in change) {
+        msg['discarded'] = change.discarded;
+      }
+      if (change.cookieStoreId) {
+        msg['cookie_store_id'] = change.cookieStoreId;
+      }
+      // Only full tab objects have it, the host uses it for tabs it doesn't know yet
+      if (change.lastAccessed) {
+        msg['last_access'] = change.lastAccessed;
+      }
     }
 
-    if (Object.keys(msg).length > 0 || force) {
+    let keys = Object.keys(msg);
+    if (keys.length > 0 || force) {
       if (activate) {
         msg['action'] = 'activate';
+      } else if (keys.every((key) => FLAG_ATTRIBUTES.includes(key))) {
+        // Discarding or muting a tab isn't user activity, so the host must not
+        // treat it as a recent use of the tab
+        if (hostProtocolVersion < 1) {
+          return;
+        }
+        msg['action'] = 'attributes';
       } else {
         msg['action'] = 'update';
       }
@@ -83,6 +121,13 @@ function initialise() {
     };
   }
 
+  function handleCreated(tab) {
+    // Only the full tab object carries cookieStoreId, onUpdated never reports it
+    if (tab.id) {
+      sendUpdateOrActivate(tab.id, [tab]);
+    }
+  }
+
   function handleUpdated(tabId, changeInfo, _tabInfo) {
     sendUpdateOrActivate(tabId, [changeInfo]);
   }
@@ -112,11 +157,33 @@ function initialise() {
     }
   }
 
+  // Lets the host drop tabs whose remove event it never got
+  async function reconcile() {
+    if (hostProtocolVersion < 1) {
+      return;
+    }
+    try {
+      let tabs = await browser.tabs.query({});
+      port.postMessage({
+        action: 'reconcile',
+        // Not used, but every message to the host needs a tab_id
+        tab_id: 0,
+        tab_ids: tabs.filter((tab) => tab.id).map((tab) => tab.id)
+      });
+    } catch (e) {
+      console.error('Reconciliation failed: ' + e);
+    }
+  }
+
+  browser.tabs.onCreated.addListener(handleCreated);
   browser.tabs.onUpdated.addListener(handleUpdated);
   browser.tabs.onActivated.addListener(handleActivated);
   browser.tabs.onRemoved.addListener(handleRemoved);
   browser.windows.onFocusChanged.addListener(handleWindowFocus);
 
+  let reconcileInterval = setInterval(reconcile, RECONCILE_INTERVAL_MS);
+  port.onDisconnect.addListener(() => clearInterval(reconcileInterval));
+
   browser.tabs.query({}).then((tabs) => {
     for (let tab of tabs) {
       if (tab.id) {
@@ -2,11 +2,12 @@ extern crate serde;
 extern crate serde_derive;
 
 use byteorder::{NativeEndian, ReadBytesExt, WriteBytesExt};
+use dbus::arg::{PropMap, RefArg, Variant};
 use dbus::blocking::Connection;
 use dbus::channel::MatchingReceiver;
 use dbus_crossroads::{Context, Crossroads};
 use serde::Serialize;
-use std::collections::HashMap;
+use std::collections::{HashMap, HashSet, VecDeque};
 use std::error::Error;
 use std::io::ErrorKind;
 use std::io::Write;
@@ -17,13 +18,40 @@ use std::thread;
 use std::time::SystemTime;
 use std::time::{Duration, Instant};
 use tabreport_common::empty_to_none;
-use tabreport_common::{unpack_tabs, TabAttributes, TabEvent, TabId, WindowId};
+use tabreport_common::{
+    from_epoch_millis, pack_columns, pack_tabs, parse_fields, to_epoch_millis, unpack_tabs,
+    TabAttributes, TabEvent, TabField, TabId, WindowId, HOST_PROTOCOL_VERSION,
+    TAB_REPORT_FIELDS_VERSION,
+};
 
 type TabData = HashMap<TabId, (SystemTime, TabAttributes)>;
 
+/// Most recently closed tabs, oldest first, with the time they were closed.
+type ClosedTabs = VecDeque<(SystemTime, TabId, TabAttributes)>;
+
+/// Hard limit on tracked open tabs, in case remove events are missed and
+/// reconciliation can't run. The least recently used tabs are dropped first.
+const MAX_OPEN_TABS: usize = 100_000;
+
+/// Longest title and URL kept per tab, in bytes, so that eg. `data:` URLs
+/// don't make each entry as large as the page content.
+const MAX_TITLE_LEN: usize = 1024;
+const MAX_URL_LEN: usize = 8192;
+
+const MAX_CLOSED_TABS: usize = 100;
+
+/// Tabs updated this recently are never evicted during reconciliation, since
+/// their events might have been sent after the extension queried the tab list.
+const RECONCILE_GRACE_PERIOD: Duration = Duration::from_secs(10);
+
 type SignalData = (Mutex<HashMap<u64, Option<String>>>, Condvar);
 
-type TabReportContext = (Arc<Mutex<TabData>>, Arc<SignalData>, Arc<AtomicU64>);
+type TabReportContext = (
+    Arc<Mutex<TabData>>,
+    Arc<Mutex<ClosedTabs>>,
+    Arc<SignalData>,
+    Arc<AtomicU64>,
+);
 
 trait KeySignal {
     fn sync_complete(&self, sequence_number: u64, error: Option<String>);
@@ -83,6 +111,13 @@ struct Command {
     sequence_number: u64,
 }
 
+/// Sent once on startup, so the extension knows which actions it can use.
+#[derive(Debug, Serialize)]
+struct Hello {
+    action: String,
+    protocol_version: u32,
+}
+
 fn get_sequence_number(source: &Arc<AtomicU64>) -> u64 {
     // % for the max integer we can use in JS with full precision.
     source.fetch_add(1, Ordering::SeqCst) % 999999999999999u64
@@ -99,19 +134,95 @@ fn serve(do_run: Arc<AtomicBool>, data: TabReportContext) -> Result<(), Box<dyn
             "TabReport",
             (),
             ("reply",),
-            |_ctx: &mut Context, (tab_data, _, _): &mut TabReportContext, (): ()| {
+            |_ctx: &mut Context, (tab_data, _, _, _): &mut TabReportContext, (): ()| {
                 let current = tab_data.lock().unwrap();
                 let result = get_sorted_list(&current);
                 Ok((unpack_tabs(&result),))
             },
         );
 
+        b.method(
+            "TabReportFields",
+            ("fields",),
+            ("version", "reply"),
+            |_ctx: &mut Context,
+             (tab_data, _, _, _): &mut TabReportContext,
+             (fields,): (Vec<String>,)| {
+                let fields = parse_fields(&fields).map_err(|e| dbus::MethodErr::invalid_arg(&e))?;
+                let current = tab_data.lock().unwrap();
+                let result: Vec<PropMap> = get_sorted_entries(&current)
+                    .into_iter()
+                    .map(|entry| tab_to_prop_map(entry, &fields))
+                    .collect();
+                Ok((TAB_REPORT_FIELDS_VERSION, result))
+            },
+        );
+
+        b.method(
+            "TabReportColumns",
+            (),
+            ("tab_ids", "window_ids", "last_access", "titles", "urls"),
+            |_ctx: &mut Context, (tab_data, _, _, _): &mut TabReportContext, (): ()| {
+                let current = tab_data.lock().unwrap();
+                let result = get_sorted_entries(&current);
+                Ok(pack_columns(&result))
+            },
+        );
+
+        b.method(
+            "TabReportPacked",
+            (),
+            ("reply",),
+            |_ctx: &mut Context, (tab_data, _, _, _): &mut TabReportContext, (): ()| {
+                let current = tab_data.lock().unwrap();
+                let result = get_sorted_entries(&current);
+                Ok((pack_tabs(&result),))
+            },
+        );
+
+        b.method(
+            "RecentlyClosed",
+            ("limit",),
+            ("version", "reply"),
+            |_ctx: &mut Context,
+             (_, closed_tabs, _, _): &mut TabReportContext,
+             (limit,): (u32,)| {
+                let closed = closed_tabs.lock().unwrap();
+                let limit = if limit == 0 {
+                    closed.len()
+                } else {
+                    limit as usize
+                };
+                // The timestamp of closed tabs is the time they were closed, so it's
+                // sent as closed_at instead of last_access
+                let fields: Vec<TabField> = TabField::ALL
+                    .iter()
+                    .copied()
+                    .filter(|v| *v != TabField::LastAccess)
+                    .collect();
+                let result: Vec<PropMap> = closed
+                    .iter()
+                    .rev()
+                    .take(limit)
+                    .map(|(ts, tab_id, attributes)| {
+                        let mut props = tab_to_prop_map((*tab_id, ts, attributes), &fields);
+                        props.insert(
+                            "closed_at".to_string(),
+                            Variant(Box::new(to_epoch_millis(ts))),
+                        );
+                        props
+                    })
+                    .collect();
+                Ok((TAB_REPORT_FIELDS_VERSION, result))
+            },
+        );
+
         b.method(
             "Activate",
             ("tab_id", "window_title_preface"),
             ("reply",),
             move |_ctx: &mut Context,
-                  (_, signal_data, seq_nums): &mut TabReportContext,
+                  (_, _, signal_data, seq_nums): &mut TabReportContext,
                   (tab_id, title_preface): (TabId, String)| {
                 let preface = empty_to_none(title_preface);
 
@@ -141,7 +252,7 @@ fn serve(do_run: Arc<AtomicBool>, data: TabReportContext) -> Result<(), Box<dyn
             ("tab_id",),
             ("reply",),
             |_ctx: &mut Context,
-             (_, signal_data, seq_nums): &mut TabReportContext,
+             (_, _, signal_data, seq_nums): &mut TabReportContext,
              (tab_id,): (TabId,)| {
                 let sequence_number = get_sequence_number(seq_nums);
 
@@ -192,33 +303,76 @@ fn serve(do_run: Arc<AtomicBool>, data: TabReportContext) -> Result<(), Box<dyn
 }
 
 fn write_to_stdout(body: &str) -> Result<(String,), dbus::MethodErr> {
-    let bytes = body.as_bytes();
-    let mut stdout = io::stdout();
-    stdout
-        .write_u32::<NativeEndian>(bytes.len() as u32)
-        .map_err(|e| dbus::MethodErr::failed(&e))?;
+    write_message(body).map_err(|e| dbus::MethodErr::failed(&e))?;
 
-    stdout
-        .write_all(bytes)
-        .map_err(|e| dbus::MethodErr::failed(&e))?;
+    Ok(("done".to_string(),))
+}
 
-    stdout.flush().map_err(|e| dbus::MethodErr::failed(&e))?;
+fn write_message(body: &str) -> io::Result<()> {
+    let bytes = body.as_bytes();
+    let mut stdout = io::stdout();
+    stdout.write_u32::<NativeEndian>(bytes.len() as u32)?;
+    stdout.write_all(bytes)?;
+    stdout.flush()
+}
 
-    Ok(("done".to_string(),))
+fn get_sorted_list(
+    map: &HashMap<TabId, (SystemTime, TabAttributes)>,
+) -> Vec<(TabId, &TabAttributes)> {
+    get_sorted_entries(map)
+        .into_iter()
+        .map(|(key, _, value)| (key, value))
+        .collect()
 }
 
-fn get_sorted_list<'a>(
+fn get_sorted_entries<'a>(
     map: &'a HashMap<TabId, (SystemTime, TabAttributes)>,
-) -> Vec<(TabId, &'a TabAttributes)> {
-    let mut result: Vec<(&SystemTime, (TabId, &'a TabAttributes))> = Vec::with_capacity(map.len());
+) -> Vec<(TabId, &'a SystemTime, &'a TabAttributes)> {
+    let mut result: Vec<(TabId, &'a SystemTime, &'a TabAttributes)> = Vec::with_capacity(map.len());
 
     for (key, (ts, value)) in map {
-        result.push((ts, (*key, value)));
+        result.push((*key, ts, value));
     }
 
-    result.sort_by(|a, b| b.0.cmp(a.0));
+    result.sort_by(|a, b| b.1.cmp(a.1));
 
-    result.into_iter().map(|v| v.1).collect()
+    result
+}
+
+fn tab_to_prop_map(
+    (tab_id, ts, attributes): (TabId, &SystemTime, &TabAttributes),
+    fields: &[TabField],
+) -> PropMap {
+    let mut result = PropMap::new();
+    result.insert("tab_id".to_string(), Variant(Box::new(tab_id)));
+
+    for field in fields {
+        let value: Option<Box<dyn RefArg>> = match field {
+            TabField::Title => attributes
+                .title
+                .clone()
+                .map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::Url => attributes
+                .url
+                .clone()
+                .map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::WindowId => attributes.window_id.map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::LastAccess => Some(Box::new(to_epoch_millis(ts)) as Box<dyn RefArg>),
+            TabField::Pinned => attributes.pinned.map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::Audible => attributes.audible.map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::Discarded => attributes.discarded.map(|v| Box::new(v) as Box<dyn RefArg>),
+            TabField::CookieStoreId => attributes
+                .cookie_store_id
+                .clone()
+                .map(|v| Box::new(v) as Box<dyn RefArg>),
+        };
+
+        if let Some(value) = value {
+            result.insert(field.name().to_string(), Variant(value));
+        }
+    }
+
+    result
 }
 
 fn log<S>(_msg: S)
@@ -251,9 +405,18 @@ fn main() -> io::Result<()> {
     })
     .expect("Error setting Ctrl-C handler");
 
+    let hello = Hello {
+        action: "hello".to_string(),
+        protocol_version: HOST_PROTOCOL_VERSION,
+    };
+    write_message(&serde_json::to_string(&hello)?)?;
+
     let tab_data = Arc::new(Mutex::new(TabData::new()));
     let server_tab_data = Arc::clone(&tab_data);
 
+    let closed_tabs = Arc::new(Mutex::new(ClosedTabs::with_capacity(MAX_CLOSED_TABS)));
+    let server_closed_tabs = Arc::clone(&closed_tabs);
+
     let signal_data = Arc::new((Mutex::new(HashMap::new()), Condvar::new()));
     let server_signal_data = Arc::clone(&signal_data);
 
@@ -263,6 +426,7 @@ fn main() -> io::Result<()> {
             server_do_run,
             (
                 server_tab_data,
+                server_closed_tabs,
                 server_signal_data,
                 Arc::new(AtomicU64::new(0)),
             ),
@@ -285,7 +449,7 @@ fn main() -> io::Result<()> {
             }
         };
 
-        process_event(event, &tab_data, &signal_data);
+        process_event(event, &tab_data, &closed_tabs, &signal_data);
     }
 
     dbus_thread.join().unwrap();
@@ -293,18 +457,53 @@ fn main() -> io::Result<()> {
     Ok(())
 }
 
-fn process_event(event: TabEvent, tab_data: &Mutex<TabData>, signal_data: &SignalData) {
+fn process_event(
+    event: TabEvent,
+    tab_data: &Mutex<TabData>,
+    closed_tabs: &Mutex<ClosedTabs>,
+    signal_data: &SignalData,
+) {
     if event.action == "remove" {
         let mut data = tab_data.lock().unwrap();
-        if data.remove(&event.tab_info.tab_id).is_none() {
-            log(format!("No entry with id {} found", event.tab_info.tab_id));
+        match data.remove(&event.tab_info.tab_id) {
+            Some((_, attributes)) => {
+                let mut closed = closed_tabs.lock().unwrap();
+                add_closed_tab(&mut closed, event.tab_info.tab_id, attributes);
+            }
+            None => log(format!("No entry with id {} found", event.tab_info.tab_id)),
         }
     } else if event.action == "sync" {
         log(format!("Received sync for {:?}", event.sequence_number));
-        signal_data.sync_complete(event.sequence_number.unwrap_or(0u64), event.error);
-    } else {
+        match event.sequence_number {
+            Some(sequence_number) => signal_data.sync_complete(sequence_number, event.error),
+            // Extensions that predate the "hello" message answer it like a command,
+            // without a sequence number. That must not complete command 0.
+            None => log("Ignoring sync without sequence number"),
+        }
+    } else if event.action == "reconcile" {
+        match event.tab_ids {
+            Some(tab_ids) => {
+                let mut data = tab_data.lock().unwrap();
+                let mut closed = closed_tabs.lock().unwrap();
+                reconcile(&mut data, &mut closed, &tab_ids);
+            }
+            // Treating this as "no open tabs" would wipe all the host's state
+            None => log("Ignoring reconcile event without tab_ids"),
+        }
+    } else if event.action == "attributes" {
+        // Changes that don't reflect tab usage, like pinned / audible / discarded
+        // flags, so they must not affect the tab's position in the list
+        let mut data = tab_data.lock().unwrap();
+        if let Some(existing) = data.get_mut(&event.tab_info.tab_id) {
+            let mut attributes = event.tab_info.attributes;
+            truncate_attributes(&mut attributes);
+            attributes.merge(&existing.1);
+            existing.1 = attributes;
+        }
+    } else if event.action == "update" || event.action == "activate" {
         let mut data = tab_data.lock().unwrap();
         let mut attributes = event.tab_info.attributes;
+        truncate_attributes(&mut attributes);
         let curr_time = SystemTime::now();
         if let Some(existing) = data.get_mut(&event.tab_info.tab_id) {
             attributes.merge(&existing.1);
@@ -318,7 +517,109 @@ fn process_event(event: TabEvent, tab_data: &Mutex<TabData>, signal_data: &Signa
             // have changed, so that we can track the last activation of each tab.
             // So if they happen to be sent after the removal of the tab, we need to
             // ensure we don't re-add them to the list here.
-            data.insert(event.tab_info.tab_id, (curr_time, attributes));
+            // Full tab objects carry Firefox's lastAccessed time, which gives tabs
+            // that were open before the host started a meaningful order.
+            let ts = event
+                .tab_info
+                .last_access
+                .map(|v| from_epoch_millis(v).min(curr_time))
+                .unwrap_or(curr_time);
+            insert_tab(
+                &mut data,
+                event.tab_info.tab_id,
+                (ts, attributes),
+                MAX_OPEN_TABS,
+            );
+        }
+    } else {
+        // Newer extensions may send actions this host doesn't know about,
+        // they must not be mistaken for updates
+        log(format!("Ignoring unknown action {}", event.action));
+    }
+}
+
+fn add_closed_tab(closed: &mut ClosedTabs, tab_id: TabId, attributes: TabAttributes) {
+    // Without a URL there's nothing to reopen
+    if attributes.url.is_none() {
+        return;
+    }
+    if closed.len() >= MAX_CLOSED_TABS {
+        closed.pop_front();
+    }
+    closed.push_back((SystemTime::now(), tab_id, attributes));
+}
+
+fn truncate_attributes(attributes: &mut TabAttributes) {
+    if let Some(title) = attributes.title.as_mut() {
+        truncate_string(title, MAX_TITLE_LEN);
+    }
+    if let Some(url) = attributes.url.as_mut() {
+        truncate_string(url, MAX_URL_LEN);
+    }
+}
+
+fn truncate_string(value: &mut String, max_len: usize) {
+    if value.len() > max_len {
+        let mut len = max_len;
+        while !value.is_char_boundary(len) {
+            len -= 1;
+        }
+        value.truncate(len);
+    }
+}
+
+fn insert_tab(
+    data: &mut TabData,
+    tab_id: TabId,
+    entry: (SystemTime, TabAttributes),
+    max_tabs: usize,
+) {
+    if data.len() >= max_tabs {
+        // Make room for 1% more tabs than needed, so that once the limit is
+        // reached we don't scan the whole map on every insert.
+        let count = data.len() + 1 - max_tabs + max_tabs / 100;
+        log(format!("Too many tabs, dropping {}", count));
+        evict_least_recent(data, count);
+    }
+    data.insert(tab_id, entry);
+}
+
+fn evict_least_recent(data: &mut TabData, count: usize) {
+    if count == 0 {
+        return;
+    }
+
+    let mut entries: Vec<(SystemTime, TabId)> = data
+        .iter()
+        .map(|(tab_id, (ts, _))| (*ts, *tab_id))
+        .collect();
+
+    if count < entries.len() {
+        entries.select_nth_unstable(count - 1);
+        entries.truncate(count);
+    }
+
+    for (_, tab_id) in entries {
+        data.remove(&tab_id);
+    }
+}
+
+/// Drops tabs the extension no longer reports. They are most likely tabs whose
+/// remove event was missed, so they are added to the closed tab history.
+fn reconcile(data: &mut TabData, closed: &mut ClosedTabs, tab_ids: &[TabId]) {
+    let open: HashSet<&TabId> = tab_ids.iter().collect();
+    let threshold = SystemTime::now() - RECONCILE_GRACE_PERIOD;
+
+    let ghosts: Vec<TabId> = data
+        .iter()
+        .filter(|(tab_id, (ts, _))| !open.contains(tab_id) && *ts < threshold)
+        .map(|(tab_id, _)| *tab_id)
+        .collect();
+
+    for tab_id in ghosts {
+        log(format!("Reconciliation dropping {}", tab_id));
+        if let Some((_, attributes)) = data.remove(&tab_id) {
+            add_closed_tab(closed, tab_id, attributes);
         }
     }
 }
@@ -357,6 +658,7 @@ mod tests {
     #[test]
     fn test_process_event_given_a_new_tab_if_event_is_activate_it_should_not_be_added() {
         let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
         let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
 
         let action = "activate".to_string();
@@ -366,13 +668,15 @@ mod tests {
             action,
             sequence_number: None,
             error: None,
+            tab_ids: None,
             tab_info: TabInfo {
                 tab_id: tab_id,
+                last_access: None,
                 attributes: TabAttributes::default(),
             },
         };
 
-        process_event(event, &tab_data, &signal_data);
+        process_event(event, &tab_data, &closed_tabs, &signal_data);
 
         let data = tab_data.lock().unwrap();
         assert!(data.get(&tab_id).is_none());
@@ -381,6 +685,7 @@ mod tests {
     #[test]
     fn test_process_event_given_a_new_tab_if_event_is_update_it_should_be_added() {
         let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
         let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
 
         let action = "update".to_string();
@@ -390,15 +695,313 @@ mod tests {
             action,
             sequence_number: None,
             error: None,
+            tab_ids: None,
             tab_info: TabInfo {
                 tab_id: tab_id,
+                last_access: None,
                 attributes: TabAttributes::default(),
             },
         };
 
-        process_event(event, &&tab_data, &&signal_data);
+        process_event(event, &&tab_data, &&closed_tabs, &&signal_data);
 
         let data = tab_data.lock().unwrap();
         assert!(data.get(&tab_id).is_some());
     }
+
+    #[test]
+    fn test_process_event_given_an_existing_tab_if_event_is_activate_it_should_keep_attributes() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let tab_id = 123;
+
+        let update = TabEvent {
+            action: "update".to_string(),
+            sequence_number: None,
+            error: None,
+            tab_ids: None,
+            tab_info: TabInfo {
+                tab_id: tab_id,
+                last_access: None,
+                attributes: TabAttributes {
+                    pinned: Some(true),
+                    cookie_store_id: Some("firefox-container-1".to_string()),
+                    ..TabAttributes::default()
+                },
+            },
+        };
+
+        let activate = TabEvent {
+            action: "activate".to_string(),
+            sequence_number: None,
+            error: None,
+            tab_ids: None,
+            tab_info: TabInfo {
+                tab_id: tab_id,
+                last_access: None,
+                attributes: TabAttributes::default(),
+            },
+        };
+
+        process_event(update, &tab_data, &closed_tabs, &signal_data);
+        process_event(activate, &tab_data, &closed_tabs, &signal_data);
+
+        let data = tab_data.lock().unwrap();
+        let (_, attributes) = data.get(&tab_id).unwrap();
+        assert_eq!(attributes.pinned, Some(true));
+        assert_eq!(
+            attributes.cookie_store_id.as_deref(),
+            Some("firefox-container-1")
+        );
+    }
+
+    #[test]
+    fn test_tab_to_prop_map_should_only_include_requested_fields_with_values() {
+        let ts = SystemTime::now();
+        let attributes = TabAttributes {
+            title: Some("Title".to_string()),
+            url: None,
+            pinned: Some(false),
+            ..TabAttributes::default()
+        };
+
+        let fields = [TabField::Title, TabField::Url, TabField::LastAccess];
+        let result = tab_to_prop_map((123, &ts, &attributes), &fields);
+
+        let mut keys: Vec<&str> = result.keys().map(|k| k.as_str()).collect();
+        keys.sort();
+        assert_eq!(keys, vec!["last_access", "tab_id", "title"]);
+        assert_eq!(
+            dbus::arg::prop_cast::<u64>(&result, "last_access"),
+            Some(&to_epoch_millis(&ts))
+        );
+    }
+
+    fn make_event(action: &str, tab_id: TabId, url: Option<&str>) -> TabEvent {
+        TabEvent {
+            action: action.to_string(),
+            sequence_number: None,
+            error: None,
+            tab_ids: None,
+            tab_info: TabInfo {
+                tab_id,
+                last_access: None,
+                attributes: TabAttributes {
+                    url: url.map(|v| v.to_string()),
+                    ..TabAttributes::default()
+                },
+            },
+        }
+    }
+
+    #[test]
+    fn test_process_event_if_event_is_remove_it_should_add_to_closed_tabs() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        for tab_id in 0..(MAX_CLOSED_TABS as TabId + 5) {
+            let url = format!("https://example.org/{}", tab_id);
+            process_event(
+                make_event("update", tab_id, Some(&url)),
+                &tab_data,
+                &closed_tabs,
+                &signal_data,
+            );
+            process_event(
+                make_event("remove", tab_id, None),
+                &tab_data,
+                &closed_tabs,
+                &signal_data,
+            );
+        }
+
+        assert!(tab_data.lock().unwrap().is_empty());
+
+        let closed = closed_tabs.lock().unwrap();
+        assert_eq!(closed.len(), MAX_CLOSED_TABS);
+        assert_eq!(closed.front().unwrap().1, 5);
+        assert_eq!(closed.back().unwrap().1, MAX_CLOSED_TABS as TabId + 4);
+    }
+
+    #[test]
+    fn test_process_event_if_event_is_reconcile_it_should_only_drop_stale_missing_tabs() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let stale = SystemTime::now() - RECONCILE_GRACE_PERIOD * 2;
+        {
+            let mut data = tab_data.lock().unwrap();
+            for tab_id in [1, 2] {
+                let attributes = TabAttributes {
+                    url: Some("https://example.org/".to_string()),
+                    ..TabAttributes::default()
+                };
+                data.insert(tab_id, (stale, attributes));
+            }
+            data.insert(3, (SystemTime::now(), TabAttributes::default()));
+        }
+
+        let mut event = make_event("reconcile", 0, None);
+        event.tab_ids = Some(vec![1]);
+        process_event(event, &tab_data, &closed_tabs, &signal_data);
+
+        let data = tab_data.lock().unwrap();
+        let mut remaining: Vec<&TabId> = data.keys().collect();
+        remaining.sort();
+        assert_eq!(remaining, vec![&1, &3]);
+
+        let closed = closed_tabs.lock().unwrap();
+        assert_eq!(closed.len(), 1);
+        assert_eq!(closed[0].1, 2);
+    }
+
+    #[test]
+    fn test_process_event_if_event_is_reconcile_without_tab_ids_it_should_be_ignored() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let stale = SystemTime::now() - RECONCILE_GRACE_PERIOD * 2;
+        let attributes = TabAttributes {
+            url: Some("https://example.org/".to_string()),
+            ..TabAttributes::default()
+        };
+        tab_data.lock().unwrap().insert(1, (stale, attributes));
+
+        process_event(
+            make_event("reconcile", 0, None),
+            &tab_data,
+            &closed_tabs,
+            &signal_data,
+        );
+
+        assert!(tab_data.lock().unwrap().get(&1).is_some());
+        assert!(closed_tabs.lock().unwrap().is_empty());
+    }
+
+    #[test]
+    fn test_process_event_given_an_unknown_action_it_should_be_ignored() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        process_event(
+            make_event("something_new", 0, Some("https://example.org/")),
+            &tab_data,
+            &closed_tabs,
+            &signal_data,
+        );
+
+        assert!(tab_data.lock().unwrap().is_empty());
+    }
+
+    #[test]
+    fn test_process_event_given_a_new_tab_with_last_access_it_should_use_it_as_timestamp() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let last_access = to_epoch_millis(&(SystemTime::now() - Duration::from_secs(3600)));
+
+        let mut older = make_event("update", 1, Some("https://example.org/1"));
+        older.tab_info.last_access = Some(last_access);
+        process_event(older, &tab_data, &closed_tabs, &signal_data);
+        process_event(
+            make_event("update", 2, Some("https://example.org/2")),
+            &tab_data,
+            &closed_tabs,
+            &signal_data,
+        );
+
+        let data = tab_data.lock().unwrap();
+        let order: Vec<TabId> = get_sorted_list(&data).iter().map(|v| v.0).collect();
+        assert_eq!(order, vec![2, 1]);
+        assert_eq!(to_epoch_millis(&data.get(&1).unwrap().0), last_access);
+    }
+
+    #[test]
+    fn test_process_event_if_event_is_attributes_it_should_not_change_the_order() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let older = SystemTime::now() - Duration::from_secs(60);
+        let newer = SystemTime::now() - Duration::from_secs(30);
+        {
+            let mut data = tab_data.lock().unwrap();
+            data.insert(1, (older, TabAttributes::default()));
+            data.insert(2, (newer, TabAttributes::default()));
+        }
+
+        let mut event = make_event("attributes", 1, None);
+        event.tab_info.attributes.discarded = Some(true);
+        process_event(event, &tab_data, &closed_tabs, &signal_data);
+
+        let data = tab_data.lock().unwrap();
+        let order: Vec<TabId> = get_sorted_list(&data).iter().map(|v| v.0).collect();
+        assert_eq!(order, vec![2, 1]);
+
+        let (ts, attributes) = data.get(&1).unwrap();
+        assert_eq!(*ts, older);
+        assert_eq!(attributes.discarded, Some(true));
+    }
+
+    #[test]
+    fn test_insert_tab_given_a_full_map_it_should_drop_the_least_recent_tabs() {
+        let mut data = TabData::new();
+        let start = SystemTime::now();
+
+        for tab_id in 0..5 {
+            let ts = start + Duration::from_secs(tab_id as u64);
+            insert_tab(&mut data, tab_id, (ts, TabAttributes::default()), 5);
+        }
+        assert_eq!(data.len(), 5);
+
+        insert_tab(&mut data, 5, (start, TabAttributes::default()), 5);
+
+        let mut remaining: Vec<TabId> = data.keys().copied().collect();
+        remaining.sort();
+        assert_eq!(remaining, vec![1, 2, 3, 4, 5]);
+    }
+
+    #[test]
+    fn test_evict_least_recent_should_drop_the_given_number_of_oldest_tabs() {
+        let mut data = TabData::new();
+        let start = SystemTime::now();
+
+        for tab_id in [7, 3, 9, 1, 5, 2] {
+            let ts = start + Duration::from_secs(tab_id as u64);
+            data.insert(tab_id, (ts, TabAttributes::default()));
+        }
+
+        evict_least_recent(&mut data, 3);
+
+        let mut remaining: Vec<TabId> = data.keys().copied().collect();
+        remaining.sort();
+        assert_eq!(remaining, vec![5, 7, 9]);
+    }
+
+    #[test]
+    fn test_process_event_given_long_values_it_should_truncate_them() {
+        let tab_data = Mutex::new(HashMap::new());
+        let closed_tabs = Mutex::new(ClosedTabs::new());
+        let signal_data = (Mutex::new(HashMap::new()), Condvar::new());
+
+        let url = format!("data:text/plain,{}", "é".repeat(MAX_URL_LEN));
+        process_event(
+            make_event("update", 1, Some(&url)),
+            &tab_data,
+            &closed_tabs,
+            &signal_data,
+        );
+
+        let data = tab_data.lock().unwrap();
+        let stored = data.get(&1).unwrap().1.url.as_ref().unwrap();
+        assert!(stored.len() <= MAX_URL_LEN);
+        assert!(url.starts_with(stored.as_str()));
+    }
 }